@@ -1,44 +1,69 @@
+import functools
+import sys
 import typing as t
 from contextlib import contextmanager
 from enum import Enum, auto
+from http import HTTPStatus
 
 import typer
 import yaml
 from importlib_resources import files
-from jinja2 import Environment, FunctionLoader
+from jinja2 import Environment, Template
 
 import apigen.openapi as openapi
 import apigen.templates
 
-app = typer.Typer()
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # pyyaml built without libyaml
+    from yaml import SafeLoader  # type: ignore[assignment]
 
-JinjaEnv = Environment(
-    loader=FunctionLoader(
-        lambda tempalte: files(apigen.templates).joinpath(tempalte).read_text()
-    ),
-    trim_blocks=True,
-    lstrip_blocks=True,
-)
+app = typer.Typer()
 
 
+@functools.lru_cache(maxsize=None)
 def to_camel_case(some_string: str) -> str:
-    return "".join(
-        word.capitalize() for word in some_string.replace(" ", "_").split("_")
+    return "".join(map(str.capitalize, some_string.replace(" ", "_").split("_")))
+
+
+@functools.cache
+def _get_env() -> Environment:
+    env = Environment(
+        trim_blocks=True,
+        lstrip_blocks=True,
     )
+    env.filters["to_camel_case"] = to_camel_case
+    return env
 
 
-JinjaEnv.filters["to_camel_case"] = to_camel_case
+@functools.cache
+def get_template(src: str) -> Template:
+    """
+    Compiles template on first use, so commands only pay for the templates they render
+    """
+    return _get_env().from_string(files(apigen.templates).joinpath(src).read_text())
 
 
 def render_template(src: str, **kwargs: t.Any):
     with error_context(f"Could not render {src}"):
-        return JinjaEnv.get_template(src).render(**kwargs)
+        return get_template(src).render(**kwargs)
 
 
 class ErrorReport(Exception):
     pass
 
 
+def raise_error_report(msg: str, exc: Exception) -> t.NoReturn:
+    """
+    Re-raises exception as ErrorReport with msg prepended.
+    Used directly in hot loops, where entering error_context is too costly
+    """
+    if isinstance(exc, ErrorReport):
+        exc.args = (f"{msg}\n\nCaused by:\n{exc}", *exc.args[1:])
+        raise exc
+    raise ErrorReport(f"{msg}\n\nCaused by:\n{exc.__class__.__name__}: {exc}") from exc
+
+
 @contextmanager
 def error_context(
     msg: str,
@@ -46,12 +71,7 @@ def error_context(
     try:
         yield
     except Exception as exc:  # pylint: disable=[W0703,]
-        if isinstance(exc, ErrorReport):
-            exc.args = (f"{msg}\n\nCaused by:\n{exc}", *exc.args[1:])
-            raise
-        raise ErrorReport(
-            f"{msg}\n\nCaused by:\n{exc.__class__.__name__}: {exc}"
-        ) from exc
+        raise_error_report(msg, exc)
 
 
 TYPE_MAPPING = {
@@ -61,44 +81,79 @@ TYPE_MAPPING = {
     "boolean": "bool",
 }
 
+# (required, optional) rust type of each scalar
+SCALAR_FORMS = {
+    name: (rust_type, f"Option<{rust_type}>")
+    for name, rust_type in TYPE_MAPPING.items()
+}
+
+# Default value providers, keyed by (schema type, value)
+Providers = t.Dict[t.Tuple[str, t.Any], t.Dict[str, str]]
+
 
 def get_reference_name(reference: openapi.SchemaReference) -> str:
     return reference.ref.split("/")[-1]
 
 
+def _render_scalar_inline(schema: openapi.Scalar) -> str:
+    return TYPE_MAPPING[schema.type]
+
+
+def _render_array_inline(schema: openapi.ArraySchema) -> str:
+    return f"Vec<{render_inline(schema.items)}>"
+
+
+def _render_hashmap_inline(schema: openapi.ObjectSchema) -> str:
+    if schema.additionalProperties is None:
+        raise ValueError(f"Could not render {schema} as inline type")
+    return f"HashMap<String,{render_inline(schema.additionalProperties)}>"
+
+
+_INLINE_RENDERERS: t.Dict[type, t.Callable[[t.Any], str]] = {
+    **dict.fromkeys(openapi.SCALAR, _render_scalar_inline),
+    openapi.SchemaReference: get_reference_name,
+    openapi.ArraySchema: _render_array_inline,
+    openapi.ObjectSchema: _render_hashmap_inline,
+}
+
+_ARRAY_ITEM_RENDERERS: t.Dict[type, t.Callable[[t.Any], str]] = {
+    **dict.fromkeys(openapi.SCALAR, _render_scalar_inline),
+    openapi.SchemaReference: get_reference_name,
+}
+
+
+def render_inline(schema: openapi.SchemaOrReference) -> str:
+    """
+    Renders a type that can be imputed inline or raises an error
+    """
+    renderer = _INLINE_RENDERERS.get(type(schema))
+    if renderer is None:
+        raise ValueError(f"Could not render {schema} as inline type")
+    return renderer(schema)
+
+
 def _get_schema_prop(title: str, schema: openapi.SchemaOrReference):
     assert isinstance(title, str)
-    if isinstance(schema, openapi.SCALAR):
-        return {
-            "doc": schema.description,
-            "title": title,
-            "type": TYPE_MAPPING[schema.type],
-        }
+    if type(schema) not in _INLINE_RENDERERS or (
+        isinstance(schema, openapi.ObjectSchema) and schema.additionalProperties is None
+    ):
+        raise NotImplementedError(f"Cannot serialize struct property {schema}")
 
-    if isinstance(schema, openapi.SchemaReference):
-        return {"doc": None, "title": title, "type": get_reference_name(schema)}
+    return {
+        "doc": getattr(schema, "description", None),
+        "title": title,
+        "type": render_inline(schema),
+    }
 
-    if (
-        isinstance(schema, openapi.ObjectSchema)
-        and schema.additionalProperties is not None
-    ):
-        return {
-            "doc": schema.description,
-            "title": title,
-            "type": f"HashMap<String,{render_inline(schema.additionalProperties)}>",
-        }
 
-    if isinstance(schema, openapi.ArraySchema):
+def get_schema_prop(title: str, schema: openapi.SchemaOrReference, prop_required: bool):
+    if isinstance(schema, openapi.SCALAR):
         return {
             "doc": schema.description,
             "title": title,
-            "type": f"Vec<{render_inline(schema.items)}>",
+            "type": SCALAR_FORMS[schema.type][0 if prop_required else 1],
         }
 
-    raise NotImplementedError(f"Cannot serialize struct property {schema}")
-
-
-def get_schema_prop(title: str, schema: openapi.SchemaOrReference, prop_required: bool):
     rendered = _get_schema_prop(title, schema)
     if not prop_required:
         rendered["type"] = f"Option<{rendered['type']}>"
@@ -108,47 +163,24 @@ def get_schema_prop(title: str, schema: openapi.SchemaOrReference, prop_required
 def serialzie_props(
     properties: t.Dict[str, openapi.SchemaOrReference], required: t.List[str]
 ) -> t.List[t.Dict[str, str]]:
-    props = list()
+    props = []
     required_set = set(required)
     for prop_title, prop in properties.items():
         prop_required = prop_title in required_set
-        with error_context(f"Could not serialize property {prop_title}"):
+        try:
             props.append(get_schema_prop(prop_title, prop, prop_required))
+        except Exception as exc:  # pylint: disable=[W0703,]
+            raise_error_report(f"Could not serialize property {prop_title}", exc)
     return props
 
 
-def serialzie_additional_props(schema: openapi.ObjectSchema):
-    assert schema.additionalProperties is not None
-
-
 def get_array_schema_type(schema: openapi.ArraySchema):
-
-    if isinstance(schema.items, openapi.SCALAR):
-        with error_context(f"Unknown schema type {schema.items.type}"):
-            return TYPE_MAPPING[schema.items.type]
-
-    if isinstance(schema.items, openapi.SchemaReference):
-        return get_reference_name(schema.items)
-
-    raise NotImplementedError(
-        f"Unsupported schema {schema.items}. Use reference instead"
-    )
-
-
-def render_inline(schema: openapi.SchemaOrReference):
-    """
-    Renders a type that can be imputed inline or raises an error
-    """
-    if isinstance(schema, openapi.SCALAR):
-        return TYPE_MAPPING[schema.type]
-    if isinstance(schema, openapi.SchemaReference):
-        return get_reference_name(schema)
-    if isinstance(schema, openapi.ArraySchema):
-        return f"Vec<{render_inline(schema.items)}>"
-    if isinstance(schema, openapi.ObjectSchema):
-        if schema.additionalProperties is not None:
-            return f"HashMap<String,{render_inline(schema.additionalProperties)}>"
-    raise ValueError(f"Could not render {schema} as inline type")
+    renderer = _ARRAY_ITEM_RENDERERS.get(type(schema.items))
+    if renderer is None:
+        raise NotImplementedError(
+            f"Unsupported schema {schema.items}. Use reference instead"
+        )
+    return renderer(schema.items)
 
 
 def serialize_struct_or_vec(title: str, schema: openapi.Schema):
@@ -161,8 +193,7 @@ def serialize_struct_or_vec(title: str, schema: openapi.Schema):
         with error_context("Could not get vec type"):
             array_type = get_array_schema_type(schema)
 
-        return render_template(
-            "vec.rs",
+        return get_template("vec.rs").render(
             doc=schema.description,
             title=title,
             type=array_type,
@@ -173,125 +204,82 @@ def serialize_struct_or_vec(title: str, schema: openapi.Schema):
             with error_context("Could not serialize properties"):
                 props = serialzie_props(schema.properties, schema.required)
 
-            return render_template(
-                "struct.rs",
+            return get_template("struct.rs").render(
                 doc=schema.description,
                 title=title,
                 props=props,
             )
         if schema.additionalProperties is not None:
 
-            return render_template(
-                "hashmap.rs",
+            return get_template("hashmap.rs").render(
                 title=title,
                 type=render_inline(schema.additionalProperties),
             )
 
     if isinstance(schema, openapi.StringSchema):
         if schema.enum:
-            return render_template("enum.rs", title=title, variants=schema.enum)
+            return get_template("enum.rs").render(title=title, variants=schema.enum)
         raise NotImplementedError("String schemas are not implemented")
 
     raise NotImplementedError(f"Unsupported schema type: {schema.type}")
 
 
-ERRORCODE_NAME_MAPPING = {
-    "100": "CONTINUE",
-    "101": "SWITCHING_PROTOCOLS",
-    "102": "PROCESSING",
-    "200": "OK",
-    "201": "CREATED",
-    "202": "ACCEPTED",
-    "203": "NON_AUTHORITATIVE_INFORMATION",
-    "204": "NO_CONTENT",
-    "205": "RESET_CONTENT",
-    "206": "PARTIAL_CONTENT",
-    "207": "MULTI_STATUS",
-    "208": "ALREADY_REPORTED",
-    "226": "IM_USED",
-    "300": "MULTIPLE_CHOICES",
-    "301": "MOVED_PERMANENTLY",
-    "302": "FOUND",
-    "303": "SEE_OTHER",
-    "304": "NOT_MODIFIED",
-    "305": "USE_PROXY",
-    "307": "TEMPORARY_REDIRECT",
-    "308": "PERMANENT_REDIRECT",
-    "400": "BAD_REQUEST",
-    "401": "UNAUTHORIZED",
-    "402": "PAYMENT_REQUIRED",
-    "403": "FORBIDDEN",
-    "404": "NOT_FOUND",
-    "405": "METHOD_NOT_ALLOWED",
-    "406": "NOT_ACCEPTABLE",
-    "407": "PROXY_AUTHENTICATION_REQUIRED",
-    "408": "REQUEST_TIMEOUT",
-    "409": "CONFLICT",
-    "410": "GONE",
-    "411": "LENGTH_REQUIRED",
-    "412": "PRECONDITION_FAILED",
-    "413": "PAYLOAD_TOO_LARGE",
-    "414": "URI_TOO_LONG",
-    "415": "UNSUPPORTED_MEDIA_TYPE",
-    "416": "RANGE_NOT_SATISFIABLE",
-    "417": "EXPECTATION_FAILED",
-    "418": "IM_A_TEAPOT",
-    "421": "MISDIRECTED_REQUEST",
-    "422": "UNPROCESSABLE_ENTITY",
-    "423": "LOCKED",
-    "424": "FAILED_DEPENDENCY",
-    "426": "UPGRADE_REQUIRED",
-    "428": "PRECONDITION_REQUIRED",
-    "429": "TOO_MANY_REQUESTS",
-    "431": "REQUEST_HEADER_FIELDS_TOO_LARGE",
-    "451": "UNAVAILABLE_FOR_LEGAL_REASONS",
-    "500": "INTERNAL_SERVER_ERROR",
-    "501": "NOT_IMPLEMENTED",
-    "502": "BAD_GATEWAY",
-    "503": "SERVICE_UNAVAILABLE",
-    "504": "GATEWAY_TIMEOUT",
-    "505": "HTTP_VERSION_NOT_SUPPORTED",
-    "506": "VARIANT_ALSO_NEGOTIATES",
-    "507": "INSUFFICIENT_STORAGE",
-    "508": "LOOP_DETECTED",
-    "510": "NOT_EXTENDED",
-    "511": "NETWORK_AUTHENTICATION_REQUIRED",
+# Names of rust's http::StatusCode constants that differ from http.HTTPStatus
+STATUS_CODE_NAME_OVERRIDES = {
+    413: "PAYLOAD_TOO_LARGE",
+    414: "URI_TOO_LONG",
+    416: "RANGE_NOT_SATISFIABLE",
+    422: "UNPROCESSABLE_ENTITY",
 }
 
+# Known to http.HTTPStatus, but not guaranteed to exist in the http crate actix-web uses
+UNSUPPORTED_STATUS_CODES = {
+    103,  # EARLY_HINTS
+    425,  # TOO_EARLY
+}
 
-def render_error(service: openapi.Service):
-    error_variants = list()
 
-    for code, response in service.responses.items():
-        if code.startswith("2"):
-            continue
+def get_status_code_name(code: str) -> str:
+    status = HTTPStatus(int(code))
+    if status.value in UNSUPPORTED_STATUS_CODES:
+        raise ValueError(f"Status code {code} is not supported")
+    return STATUS_CODE_NAME_OVERRIDES.get(status.value, status.name)
+
+
+def render_error(service: openapi.Service):
+    error_variants = []
 
+    for code, response in service.error_responses.items():
         response_schema = response.content["application/json"].schema_
         if not isinstance(response_schema, openapi.StringSchema):
             raise NotImplementedError("Only strings in errors are allowed")
         if response_schema.enum is None:
             raise NotImplementedError("Must provide error variants")
         for variant in response_schema.enum:
-            with error_context(f"Could not render error variant {code} {variant}"):
+            try:
                 error_variants.append(
                     {
                         "code": code,
                         "detail": variant,
-                        "code_name": ERRORCODE_NAME_MAPPING[code],
+                        "code_name": get_status_code_name(code),
                     }
                 )
+            except Exception as exc:  # pylint: disable=[W0703,]
+                raise_error_report(
+                    f"Could not render error variant {code} {variant}", exc
+                )
 
     if len(error_variants) == 0:
         return None, None
 
     error_type = to_camel_case(service.operation_id) + "Error"
 
-    return error_type, render_template(
-        "error.rs",
-        error_type=error_type,
-        operation_id=service.operation_id,
-        variants=error_variants,
-    )
+    with error_context("Could not render error.rs"):
+        return error_type, get_template("error.rs").render(
+            error_type=error_type,
+            operation_id=service.operation_id,
+            variants=error_variants,
+        )
 
 
 class ParameterLocation(Enum):
@@ -314,10 +302,7 @@ def get_parameter_type(
     if loc == ParameterLocation.QUERY and isinstance(schema, openapi.SchemaReference):
         return None
     if isinstance(schema, openapi.SCALAR):
-        rendered = render_inline(schema)
-        if not required:
-            rendered = f"Option<{rendered}>"
-        return rendered
+        return SCALAR_FORMS[schema.type][0 if required else 1]
     raise NotImplementedError(f"{loc} {schema}")
 
 
@@ -347,13 +332,16 @@ def render_as_rust_value(val: t.Any):
     return repr(val)
 
 
-def get_provider_name(providers: t.Dict[str, t.Any], value: t.Any, value_type: str):
-    if value in providers:
-        return providers[value]["name"]
+def get_provider_name(providers: Providers, value: t.Any, value_type: str):
+    # Keyed by type as well, since 1 == True would share a provider otherwise
+    key = (value_type, value)
+    provider = providers.get(key)
+    if provider is not None:
+        return provider["name"]
 
     name = _get_new_provider_name(value)
 
-    providers[value] = {
+    providers[key] = {
         "name": name,
         "value": render_as_rust_value(value),
         "type": TYPE_MAPPING[value_type],
@@ -362,17 +350,17 @@ def get_provider_name(providers: t.Dict[str, t.Any], value: t.Any, value_type: s
     return name
 
 
-def render_error_and_method(providers: t.Dict[str, t.Any], service: openapi.Service):
+def render_error_and_method(providers: Providers, service: openapi.Service):
 
-    success_response = service.responses["200"].content["application/json"].schema_
+    success_response = service.success_response.content["application/json"].schema_
 
     response_inline = render_response_type(success_response)
 
     error_type, error = render_error(service)
 
-    path_parameters = list()
-    query_parameters = list()
-    parameters = list()
+    path_parameters = []
+    query_parameters = []
+    parameters = []
 
     for parameter in service.parameters:
 
@@ -430,7 +418,7 @@ def rs(spec_file: typer.FileText):
     """
     Prints rust module from given spec
     """
-    spec_obj = yaml.safe_load(spec_file.read())
+    spec_obj = yaml.load(spec_file, Loader=SafeLoader)
 
     with error_context("Could not extract schemas"):
         schemas = openapi.extract_schemas(spec_obj)
@@ -438,30 +426,34 @@ def rs(spec_file: typer.FileText):
     with error_context("Could not extract services"):
         services = openapi.extract_services(spec_obj)
 
-    models = list()
+    models = []
     for name, schema in schemas.schemas.items():
-        with error_context(f"Error reading /components/schemas/{name}"):
+        try:
             models.append(serialize_struct_or_vec(name, schema))
+        except Exception as exc:  # pylint: disable=[W0703,]
+            raise_error_report(f"Error reading /components/schemas/{name}", exc)
 
-    errors = list()
-    methods = list()
+    errors = []
+    methods = []
 
-    providers = dict()
-    for error in services:
-        error, method = render_error_and_method(providers, error)
+    providers: Providers = {}
+    for service in services:
+        error, method = render_error_and_method(providers, service)
         if error is not None:
             errors.append(error)
         methods.append(method)
 
-    print(
-        render_template(
-            "api.rs",
+    # Stream the module instead of building it in memory, as it grows with the spec
+    with error_context("Could not render api.rs"):
+        stream = get_template("api.rs").stream(
             models=models,
             errors=errors,
             methods=methods,
             providers=list(providers.values()),
         )
-    )
+        stream.enable_buffering(size=32)
+        sys.stdout.writelines(stream)
+    sys.stdout.write("\n")
 
 
 @app.command()
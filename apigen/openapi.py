@@ -6,62 +6,69 @@ from __future__ import annotations
 
 import typing as t
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Discriminator, Field, Tag
 
 
-class SchemaReference(BaseModel):
+class OpenapiModel(BaseModel):
+    # Yaml parses unquoted string examples, enum values, etc. as numbers
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+
+class SchemaReference(OpenapiModel):
     ref: str = Field(alias="$ref")
 
 
-class NumberSchema(BaseModel):
+class NumberSchema(OpenapiModel):
     type: t.Literal["number"] = "number"
-    title: t.Optional[str]
-    description: t.Optional[str]
-    example: t.Optional[float]
-    default: t.Optional[float]
+    title: t.Optional[str] = None
+    description: t.Optional[str] = None
+    example: t.Optional[float] = None
+    default: t.Optional[float] = None
 
 
-class IntegerSchema(BaseModel):
+class IntegerSchema(OpenapiModel):
     type: t.Literal["integer"] = "integer"
-    title: t.Optional[str]
-    description: t.Optional[str]
-    example: t.Optional[int]
-    default: t.Optional[int]
+    title: t.Optional[str] = None
+    description: t.Optional[str] = None
+    example: t.Optional[int] = None
+    default: t.Optional[int] = None
 
 
-class StringSchema(BaseModel):
+class StringSchema(OpenapiModel):
     type: t.Literal["string"] = "string"
-    title: t.Optional[str]
-    description: t.Optional[str]
-    example: t.Optional[str]
-    enum: t.Optional[t.List[str]]
-    default: t.Optional[str]
+    title: t.Optional[str] = None
+    description: t.Optional[str] = None
+    example: t.Optional[str] = None
+    enum: t.Optional[t.List[str]] = None
+    default: t.Optional[str] = None
 
 
-class BooleanSchema(BaseModel):
+class BooleanSchema(OpenapiModel):
     type: t.Literal["boolean"] = "boolean"
-    title: t.Optional[str]
-    description: t.Optional[str]
-    example: t.Optional[bool]
-    default: t.Optional[bool]
+    title: t.Optional[str] = None
+    description: t.Optional[str] = None
+    example: t.Optional[bool] = None
+    default: t.Optional[bool] = None
+
 
+Scalar = t.Union[NumberSchema, IntegerSchema, StringSchema, BooleanSchema]
 
 SCALAR = (NumberSchema, IntegerSchema, StringSchema, BooleanSchema)
 
 
-class ObjectSchema(BaseModel):
+class ObjectSchema(OpenapiModel):
     type: t.Literal["object"] = "object"
     required: t.List[str]
-    title: t.Optional[str]
-    description: t.Optional[str]
-    properties: t.Optional[t.Dict[str, SchemaOrReference]]
-    additionalProperties: t.Optional[SchemaOrReference]
+    title: t.Optional[str] = None
+    description: t.Optional[str] = None
+    properties: t.Optional[t.Dict[str, SchemaOrReference]] = None
+    additionalProperties: t.Optional[SchemaOrReference] = None
 
 
-class ArraySchema(BaseModel):
+class ArraySchema(OpenapiModel):
     type: t.Literal["array"] = "array"
-    title: t.Optional[str]
-    description: t.Optional[str]
+    title: t.Optional[str] = None
+    description: t.Optional[str] = None
     items: SchemaOrReference
 
 
@@ -86,36 +93,57 @@ SCHEMA = (
     ArraySchema,
 )
 
-SchemaOrReference = t.Union[Schema, SchemaReference]
 
-ObjectSchema.update_forward_refs()
-ArraySchema.update_forward_refs()
+def _schema_or_reference_tag(value: t.Any) -> t.Optional[str]:
+    if isinstance(value, dict):
+        return "$ref" if "$ref" in value else value.get("type")
+    if isinstance(value, SchemaReference):
+        return "$ref"
+    return getattr(value, "type", None)
+
+
+# Dispatches on "$ref" / "type" in one lookup instead of trying each union member
+SchemaOrReference = t.Annotated[
+    t.Union[
+        t.Annotated[BooleanSchema, Tag("boolean")],
+        t.Annotated[NumberSchema, Tag("number")],
+        t.Annotated[IntegerSchema, Tag("integer")],
+        t.Annotated[StringSchema, Tag("string")],
+        t.Annotated[ObjectSchema, Tag("object")],
+        t.Annotated[ArraySchema, Tag("array")],
+        t.Annotated[SchemaReference, Tag("$ref")],
+    ],
+    Discriminator(_schema_or_reference_tag),
+]
+
+ObjectSchema.model_rebuild()
+ArraySchema.model_rebuild()
 
 
-class Components(BaseModel):
+class Components(OpenapiModel):
     schemas: t.Dict[str, Schema]
 
 
 def extract_schemas(spec: t.Dict[t.Any, t.Any]):
 
     if "components" not in spec:
-        return Components(schemas=dict())
+        return Components(schemas={})
 
-    components = Components.parse_obj(spec["components"])
+    components = Components.model_validate(spec["components"])
 
     return components
 
 
-class ResponseContent(BaseModel):
+class ResponseContent(OpenapiModel):
     schema_: SchemaOrReference = Field(alias="schema")
 
 
-class Response(BaseModel):
+class Response(OpenapiModel):
     description: str
     content: t.Dict[str, ResponseContent]
 
 
-class Parameter(BaseModel):
+class Parameter(OpenapiModel):
     name: str
     required: bool
     description: str
@@ -123,51 +151,58 @@ class Parameter(BaseModel):
     schema_: SchemaOrReference = Field(alias="schema")
 
 
-class Service(BaseModel):
+class Service(OpenapiModel):
     path: str
     method: str
     summary: str
     operation_id: str
-    responses: t.Dict[str, Response]
+    success_response: Response
+    error_responses: t.Dict[str, Response]
     parameters: t.List[Parameter]
 
 
 def _get_parameter_dict(spec: t.Dict[t.Any, t.Any]):
 
     if "components" not in spec:
-        return dict()
+        return {}
 
-    result = dict()
+    result = {}
     for name, parameter in spec["components"]["parameters"].items():
         result[f"#/components/parameters/{name}"] = parameter
     return result
 
 
+_SLUG_TABLE = str.maketrans({"-": "_", "/": "_", "{": None, "}": None})
+
+
 def _path_to_slug(path: str):
-    return (
-        path.strip("/")
-        .replace("-", "_")
-        .replace("/", "_")
-        .replace("{", "")
-        .replace("}", "")
-        .lower()
-        .replace("__", "_")
-    )
+    return path.strip("/").translate(_SLUG_TABLE).lower().replace("__", "_")
 
 
 def extract_services(spec: t.Dict[t.Any, t.Any]) -> t.List[Service]:
     parameters_dict = _get_parameter_dict(spec)
+    # Shared parameters are validated on first reference, then reused by other services
+    referenced_parameters: t.Dict[str, Parameter] = {}
 
-    services = list()
+    services = []
     for path, methods_and_service in spec["paths"].items():
         for method, service in methods_and_service.items():
 
-            parameters = list()
+            # Response codes are split by prefix below, so int keys become strings
+            responses = {str(k): v for k, v in service["responses"].items()}
+
+            parameters = []
 
-            for parameter in service.get("parameters", list()):
-                if isinstance(parameter, dict) and "$ref" in parameter:
-                    parameter = parameters_dict[parameter["$ref"]]
-                parameters.append(parameter)
+            for parameter in service.get("parameters", []):
+                if "$ref" in parameter:
+                    ref = parameter["$ref"]
+                    if ref not in referenced_parameters:
+                        referenced_parameters[ref] = Parameter.model_validate(
+                            parameters_dict[ref]
+                        )
+                    parameters.append(referenced_parameters[ref])
+                else:
+                    parameters.append(Parameter.model_validate(parameter))
 
             services.append(
                 Service(
@@ -175,9 +210,11 @@ def extract_services(spec: t.Dict[t.Any, t.Any]) -> t.List[Service]:
                     method=method,
                     summary=service.get("summary", ""),
                     operation_id=service.get("operationId", _path_to_slug(path)),
-                    responses={
-                        k: Response.parse_obj(v)
-                        for k, v in service["responses"].items()
+                    success_response=Response.model_validate(responses["200"]),
+                    error_responses={
+                        k: Response.model_validate(v)
+                        for k, v in responses.items()
+                        if not k.startswith("2")
                     },
                     parameters=parameters,
                 )